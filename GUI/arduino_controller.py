@@ -1,22 +1,26 @@
-import time, serial, serial.tools.list_ports
+import os, sys, time, serial, serial.tools.list_ports
 class ArduinoController:
     """Class to manage communication with Arduino"""
 
     def __init__(self):
         self.serial = None
         self.connected = False
+        self._partial = b''
 
     def get_available_ports(self):
         """Get list of available serial ports"""
         ports = serial.tools.list_ports.comports()
         return [port.device for port in ports]
 
-    def connect(self, port, baud=115200, timeout=2):
+    def connect(self, port, baud=115200, timeout=2, low_latency=True):
         """Connect to Arduino"""
         try:
-            self.serial = serial.Serial(port, baud, timeout=timeout)
-            time.sleep(2)  # Wait for Arduino to reset
+            self.serial = serial.Serial(port, baud, timeout=timeout, write_timeout=timeout)
+            if low_latency:
+                self._enable_low_latency()
+            self._wait_until_ready(2)  # Opening the port resets the Arduino
             self.serial.reset_input_buffer()
+            self._partial = b''
             self.connected = True
             return True
         except Exception as e:
@@ -24,9 +28,68 @@ class ArduinoController:
             self.connected = False
             return False
 
+    def _wait_until_ready(self, timeout):
+        """Wait for the firmware's startup banner, at most timeout seconds.
+
+        The bootloader's delay varies from board to board, so returning as
+        soon as setup() is done beats sleeping for the worst case. Boards that
+        don't reset on connect send nothing and just use up the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # Blocks up to the port timeout without spinning
+            line = self.serial.readline()
+            # The last line setup() prints
+            if line.startswith(b'INFO: System assumes'):
+                return True
+        return False
+
+    def _enable_low_latency(self):
+        """Have the USB-serial driver hand over received bytes immediately.
+
+        On Linux this sets ASYNC_LOW_LATENCY with the TIOCGSERIAL/TIOCSSERIAL
+        ioctls, and on Windows it enlarges the driver buffers. Other platforms,
+        and ports that don't support it, are left as they are; failing to tune
+        the port never fails the connection.
+        """
+        if os.name == 'nt':
+            # Larger driver buffers stop writes being split into small blocks
+            try:
+                self.serial.set_buffer_size(rx_size=4096, tx_size=4096)
+            except (AttributeError, OSError, ValueError):
+                pass  # Not supported by this port's driver
+            return
+
+        # pyserial only implements this on Linux; elsewhere it raises
+        # NotImplementedError
+        if not sys.platform.startswith('linux'):
+            return
+
+        # Drop the FTDI latency timer from 16 ms to 1 ms
+        try:
+            self.serial.set_low_latency_mode(True)
+        except AttributeError:
+            # pyserial < 3.2: set ASYNC_LOW_LATENCY on the tty ourselves
+            try:
+                import array, fcntl, termios
+                buf = array.array('i', [0] * 32)
+                fcntl.ioctl(self.serial.fileno(), termios.TIOCGSERIAL, buf)
+                buf[4] |= 0x2000  # serial_struct.flags |= ASYNC_LOW_LATENCY
+                fcntl.ioctl(self.serial.fileno(), termios.TIOCSSERIAL, buf)
+            except (AttributeError, ImportError, OSError, ValueError):
+                pass
+        except (NotImplementedError, OSError, ValueError):
+            pass  # Not supported by this port's driver
+
     def disconnect(self):
         """Disconnect from Arduino"""
         if self.serial and self.serial.is_open:
+            # Writes don't wait to drain, so let the last ones reach the
+            # Arduino before the port goes away
+            try:
+                self.serial.flush()
+            except Exception:
+                pass  # e.g. the board was unplugged
             self.serial.close()
         self.connected = False
 
@@ -44,17 +107,64 @@ class ArduinoController:
             command += '\n'
 
         self.serial.write(command.encode())
-        self.serial.flush()
+
+    def send_command_raw(self, data):
+        """Write pre-encoded command bytes without waiting for them to drain"""
+        if not self.is_connected():
+            raise Exception("Not connected to Arduino")
+
+        self.serial.write(data)
+
+    def read_line(self):
+        """Read one response line, blocking up to the port timeout"""
+        if not self.is_connected():
+            raise Exception("Not connected to Arduino")
+
+        line = self._partial + self.serial.readline()
+        if not line.endswith(b'\n'):
+            # Timed out mid-line; keep the fragment for the next read
+            self._partial = line
+            return None
+
+        self._partial = b''
+        return line.decode(errors='ignore').strip()
+
+    def read_lines(self):
+        """Read every complete response line that has arrived, blocking up to
+        the port timeout until there is at least one"""
+        first = self.read_line()
+        if first is None:
+            return []
+
+        # Whatever else is already waiting costs one more read, not one per line
+        lines = [first]
+        waiting = self.serial.in_waiting
+        if waiting:
+            *complete, self._partial = (self._partial + self.serial.read(waiting)).split(b'\n')
+            lines.extend(line.decode(errors='ignore').strip() for line in complete)
+        return lines
+
+    def reset_input(self):
+        """Discard every response received but not yet read"""
+        if not self.is_connected():
+            raise Exception("Not connected to Arduino")
+
+        self.serial.reset_input_buffer()
+        self._partial = b''
 
     def wait_for_response(self, timeout=10):
         """Wait for response from Arduino"""
         if not self.is_connected():
             raise Exception("Not connected to Arduino")
 
-        start_time = time.time()
-        while (time.time() - start_time) < timeout:
-            if self.serial.in_waiting:
-                return self.serial.readline().decode().strip()
-            time.sleep(0.1)
+        # readline() blocks inside pyserial until a full line or the timeout
+        port_timeout = self.serial.timeout
+        if timeout == port_timeout:
+            return self.read_line()
 
-        return None
\ No newline at end of file
+        # Setting the timeout reconfigures the port, so only swap it when needed
+        self.serial.timeout = timeout
+        try:
+            return self.read_line()
+        finally:
+            self.serial.timeout = port_timeout
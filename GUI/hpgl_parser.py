@@ -1,11 +1,259 @@
+import json
+import mmap
+import os
+import re
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import compress
+
+# Command type codes
+CMD_HOME = 0
+CMD_PU = 1
+CMD_PD = 2
+CMD_PA = 3
+CMD_SP = 4
+_PA_BYTE = bytes([CMD_PA])
+
+# HPGL pen number (0-8) -> laser PWM value (0-255), and back
+SP_TO_PWM = tuple(min(255, (pen * 255) // 8) for pen in range(9))
+PWM_TO_SP = tuple(min(8, (power * 8) // 255) for power in range(256))
+
+# An HPGL statement: two-letter mnemonic and its parameters up to the next ';'.
+# Consecutive PA/PD/PU statements with the same mnemonic are matched as one
+# run, so the regex engine scans long drawings instead of the Python loop.
+# Runs are capped so a long drawing is still consumed a bounded slice at a
+# time rather than copied and split as a whole.
+_TOKEN_RE = re.compile(rb'([A-Z]{2})([^;]*(?:;\s*\1(?<=P[ADU])[^;]*){0,1023})')
+
+# What the tokenizer's \s matches between the statements of a run
+_WHITESPACE = b' \t\n\r\f\v'
+
+# A run, without whitespace, in which every statement holds whole x,y pairs
+# (or nothing) and no field is empty
+_PAIRS = rb'(?:[^,;]+,[^,;]+(?:,[^,;]+,[^,;]+)*)?'
+_WHOLE_PAIRS_RE = re.compile(rb'%s(?:;P[ADU]%s)*' % (_PAIRS, _PAIRS))
+
+# Bytes of the file tokenized per findall() call
+_WINDOW_SIZE = 1 << 16
+
+# Parameter lists at least this long are decoded as JSON; below it the
+# fixed cost of the decoder outweighs the per-value savings
+_BULK_PARSE_MIN = 256
+_json_loads = json.loads
+
+
+def iter_statements(filename):
+    """Yield (mnemonic, params) as bytes for every statement in an HPGL file.
+
+    Runs of PA, PD or PU statements come out as a single statement (several
+    for long runs or runs cut by a window edge) whose
+    params still hold the separating ";PA" etc.; parse_coordinates() reads
+    their coordinates as one list, pairing values within each statement,
+    since the repeated PD/PU would not change the pen.
+
+    The file is memory-mapped so the OS pages it in as the tokenizer goes,
+    instead of reading a copy of it into memory.
+    """
+    with open(filename, 'rb') as f:
+        # Empty files cannot be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            # The tokenizer reads front to back once; let the OS read ahead
+            # further and drop pages behind it (not available on Windows)
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                content.madvise(mmap.MADV_SEQUENTIAL)
+
+            # findall builds the (mnemonic, params) tuples in C, without a
+            # Match object per statement; windows ending on a ';' keep the
+            # list it returns small. A window edge may split a run in two;
+            # callers must not treat the second half differently (see
+            # HPGLParser.set_pen()).
+            size = len(content)
+            pos = 0
+            while pos < size:
+                end = content.find(b';', pos + _WINDOW_SIZE)
+                end = size if end < 0 else end + 1
+
+                # whitespace and ';' between statements are skipped by the tokenizer
+                yield from _TOKEN_RE.findall(content, pos, end)
+                pos = end
+
+
+@dataclass
+class CommandStream:
+    """Parsed commands stored as parallel arrays, one entry per command.
+
+    x/y are only meaningful for CMD_PA and power only for CMD_SP.
+    """
+    types: array = field(default_factory=lambda: array('B'))
+    xs: array = field(default_factory=lambda: array('i'))
+    ys: array = field(default_factory=lambda: array('i'))
+    powers: array = field(default_factory=lambda: array('B'))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        """Iterate over the commands as (type, x, y, power) tuples"""
+        return zip(self.types, self.xs, self.ys, self.powers)
+
+    def __getitem__(self, i):
+        """Return the i-th command as a (type, x, y, power) tuple"""
+        return self.types[i], self.xs[i], self.ys[i], self.powers[i]
+
+    def append(self, cmd_type, x=0, y=0, power=0):
+        """Add a command to the end of the stream"""
+        self.types.append(cmd_type)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.powers.append(power)
+
+    def extend_moves(self, xs, ys):
+        """Add a PA command for every x, y pair"""
+        # Byte-typed arrays are filled straight from bytes, with no
+        # temporary array per call
+        count = len(xs)
+        self.types.frombytes(_PA_BYTE * count)
+        self.xs.extend(xs)
+        self.ys.extend(ys)
+        self.powers.frombytes(bytes(count))
+
+    def pop(self):
+        """Remove the last command and return it as (type, x, y, power)"""
+        return self.types.pop(), self.xs.pop(), self.ys.pop(), self.powers.pop()
+
+    def copy(self):
+        """Return an independent copy of the stream"""
+        return CommandStream(self.types[:], self.xs[:], self.ys[:], self.powers[:])
+
+
+def parse_coordinates(params):
+    """Parse an HPGL parameter list into arrays of x and y coordinates.
+
+    A trailing unpaired value is ignored; in a run of statements, that is
+    the one at the end of each statement.
+    """
+    if b';' in params:
+        # Whitespace is deleted in one C pass so the separator is one fixed
+        # string, e.g. b';PA', to split the run on
+        params = params.translate(None, _WHITESPACE)
+        start = params.index(b';')
+        separator = params[start:start + 3]
+        if not _WHOLE_PAIRS_RE.fullmatch(params):
+            # Pair the values of each statement on its own
+            xs, ys = array('i'), array('i')
+            for statement in params.split(separator):
+                statement_xs, statement_ys = parse_coordinates(statement)
+                xs += statement_xs
+                ys += statement_ys
+            return xs, ys
+
+        # Every statement holds whole x,y pairs, so the run reads the same
+        # as its first statement followed by all of the run's coordinates
+        params = params.replace(separator, b',')
+
+    nums = None
+    if len(params) >= _BULK_PARSE_MIN:
+        # Long lists (runs, polylines) go through the C JSON decoder, which
+        # converts the values without a bytes object for each one
+        try:
+            nums = array('i', _json_loads(b'[%s]' % params))
+        except (ValueError, TypeError):
+            pass  # not valid JSON, e.g. empty fields or leading zeros
+
+    if nums is None:
+        try:
+            # int() accepts bytes and surrounding whitespace, so the common
+            # case converts entirely in C without building a Python list
+            nums = array('i', map(int, params.split(b',')))
+        except ValueError:
+            # Empty fields, e.g. a trailing comma or a bare "PU;"
+            nums = array('i', [int(n) for n in params.split(b',') if n.strip()])
+    pairs = len(nums) & ~1
+    return nums[0:pairs:2], nums[1:pairs:2]
+
+
+def _simplify_path(points, epsilon):
+    """Ramer-Douglas-Peucker: keep only the points needed to stay within
+    epsilon of the original polyline. The first and last points are kept.
+
+    Takes quadratic time on paths that keep most of their points, so callers
+    should pass bounded pieces (see SIMPLIFY_CHUNK).
+    """
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    stack = [(0, len(points) - 1)]
+
+    # Squared distances, so the coordinates stay integers until the last step
+    epsilon_sq = epsilon * epsilon
+
+    while stack:
+        start, end = stack.pop()
+        x0, y0 = xs[start], ys[start]
+        dx = xs[end] - x0
+        dy = ys[end] - y0
+        length_sq = dx * dx + dy * dy
+
+        # Find the point farthest from the segment start -> end
+        max_dist_sq, farthest = epsilon_sq, None
+        for i in range(start + 1, end):
+            px, py = xs[i] - x0, ys[i] - y0
+            # Distance to the segment, not the line, so moves that double
+            # back along the same line are kept
+            dot = px * dx + py * dy
+            if dot <= 0:
+                dist_sq = px * px + py * py
+            elif dot >= length_sq:
+                ex, ey = px - dx, py - dy
+                dist_sq = ex * ex + ey * ey
+            else:
+                cross = px * dy - py * dx
+                dist_sq = cross * cross / length_sq
+            if dist_sq > max_dist_sq:
+                max_dist_sq, farthest = dist_sq, i
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
 class HPGLParser:
     """Class to parse HPGL files and convert to commands for Arduino"""
 
+    # Number of parsed files to keep for re-opening
+    PARSE_CACHE_SIZE = 8
+
+    # simplify() works on pieces of at most this many points, so its time
+    # grows linearly with the length of a path
+    SIMPLIFY_CHUNK = 32
+
+    # (parser class, path, mtime, size) -> (commands, statement counts, bounds,
+    # pen state), shared by all parsers and least recently used first
+    _parse_cache = OrderedDict()
+
     def __init__(self):
+        # HPGL mnemonic -> handler taking the statement's parameters
+        self._dispatch = {
+            b'IN': self._parse_in,
+            b'PU': self._parse_pu,
+            b'PD': self._parse_pd,
+            b'PA': self.add_points,
+            b'SP': self._parse_sp,
+        }
         self.reset()
 
     def reset(self):
-        self.commands = []
+        self.commands = CommandStream()
+        self.statement_counts = {}  # supported mnemonic -> statements parsed
+        self.pen_down = None  # pen state after the last PU/PD; None before any
         self.min_x = float('inf')
         self.min_y = float('inf')
         self.max_x = float('-inf')
@@ -16,75 +264,149 @@ class HPGLParser:
         self.reset()
 
         try:
-            with open(filename, 'r') as f:
-                content = f.read()
-
-            # Remove any whitespace
-            content = content.replace(' ', '').replace('\n', '').replace('\r', '')
-
-            # Split by semicolons to get commands
-            raw_commands = content.split(';')
-
-            for cmd in raw_commands:
-                if not cmd:
-                    continue
-
-                # Extract command type (first two characters)
-                cmd_type = cmd[:2]
-
-                if cmd_type == 'IN':
-                    # Initialize
-                    self.commands.append({'type': 'HOME'})
-                elif cmd_type == 'PU':
-                    # Pen Up (Laser Off)
-                    self.commands.append({'type': 'PU'})
-
-                    # Check if coordinates follow
-                    if len(cmd) > 2:
-                        coords = cmd[2:].split(',')
-                        if len(coords) >= 2:
-                            x, y = int(coords[0]), int(coords[1])
-                            self.update_bounds(x, y)
-                            self.commands.append({'type': 'PA', 'x': x, 'y': y})
-
-                elif cmd_type == 'PD':
-                    # Pen Down (Laser On)
-                    self.commands.append({'type': 'PD'})
-
-                    # Check if coordinates follow
-                    if len(cmd) > 2:
-                        coords = cmd[2:].split(',')
-                        if len(coords) >= 2:
-                            x, y = int(coords[0]), int(coords[1])
-                            self.update_bounds(x, y)
-                            self.commands.append({'type': 'PA', 'x': x, 'y': y})
-
-                elif cmd_type == 'PA':
-                    # Plot Absolute
-                    coords = cmd[2:].split(',')
-                    if len(coords) >= 2:
-                        x, y = int(coords[0]), int(coords[1])
-                        self.update_bounds(x, y)
-                        self.commands.append({'type': 'PA', 'x': x, 'y': y})
-
-                elif cmd_type == 'SP':
-                    # Select Pen (Laser Power)
-                    if len(cmd) > 2:
-                        pen = int(cmd[2:])
-                        # Scale pen from HPGL (0-8) to PWM (0-255)
-                        power = min(255, int((pen / 8) * 255))
-                        self.commands.append({'type': 'SP', 'power': power})
+            # A file that hasn't changed since it was last parsed is not read again
+            stat = os.stat(filename)
+            key = (type(self), os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+            cache = self._parse_cache
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+                commands, counts, bounds, self.pen_down = cached
+                # Callers are free to modify what they get
+                self.commands = commands.copy()
+                self.statement_counts = dict(counts)
+                self.min_x, self.min_y, self.max_x, self.max_y = bounds
+                return True
+
+            # One pass over the file; unsupported mnemonics are ignored
+            get_handler = self._dispatch.get
+            counts = dict.fromkeys(self._dispatch, 0)
+            for cmd_type, params in iter_statements(filename):
+                handler = get_handler(cmd_type)
+                if handler is not None:
+                    handler(params)
+                    # A run matches once but holds a statement per ';'
+                    counts[cmd_type] += params.count(b';') + 1
+
+            self.statement_counts = counts
+            self._finalize_bounds()
+
+            cache[key] = (self.commands.copy(), dict(counts),
+                          (self.min_x, self.min_y, self.max_x, self.max_y), self.pen_down)
+            if len(cache) > self.PARSE_CACHE_SIZE:
+                cache.popitem(last=False)
             return True
         except Exception as e:
             print(f"Error parsing HPGL file: {e}")
             return False
 
-    def update_bounds(self, x, y):
-        """Update the min/max bounds of the drawing"""
-        self.min_x = min(self.min_x, x)
-        self.min_y = min(self.min_y, y)
-        self.max_x = max(self.max_x, x)
-        self.max_y = max(self.max_y, y)
+    @classmethod
+    def clear_cache(cls):
+        """Forget all parsed files, e.g. after editing one within the
+        file system's timestamp resolution"""
+        cls._parse_cache.clear()
+
+    def _parse_in(self, params):
+        """Initialize"""
+        self.commands.append(CMD_HOME)
+
+    def _parse_pu(self, params):
+        """Pen Up (Laser Off), then move through any coordinates that follow"""
+        self.set_pen(False)
+        self.add_points(params)
+
+    def _parse_pd(self, params):
+        """Pen Down (Laser On), then draw through any coordinates that follow"""
+        self.set_pen(True)
+        self.add_points(params)
+
+    def set_pen(self, down):
+        """Add a PD or PU command, unless the pen is already in that state.
+
+        Repeats are no-ops for the firmware. Skipping them keeps the commands
+        the same wherever the tokenizer splits a run of PD or PU statements.
+        """
+        if self.pen_down is not down:
+            self.commands.append(CMD_PD if down else CMD_PU)
+            self.pen_down = down
+
+    def _parse_sp(self, params):
+        """Select Pen (Laser Power)"""
+        if params.strip():
+            pen = int(params)
+            # Scale pen from HPGL (0-8) to PWM (0-255)
+            self.commands.append(CMD_SP, power=SP_TO_PWM[max(0, min(8, pen))])
+
+    def simplify(self, epsilon=1):
+        """Drop PA points within epsilon HPGL units of the path through their
+        neighbours. Returns the number of commands removed."""
+        commands = self.commands
+        simplified = CommandStream()
+        run = []  # consecutive PA points not yet written
+        current = (0, 0)
+
+        # Bound methods looked up once rather than per command
+        add_to_run = run.append
+        emit = simplified.append
+        emit_moves = simplified.extend_moves
+
+        def emit_run(path):
+            # Neighbouring pieces share an end point; the kept points are
+            # written as one batch, without the path's starting point
+            size = self.SIMPLIFY_CHUNK
+            kept = []
+            for start in range(0, len(path) - 1, size - 1):
+                kept += _simplify_path(path[start:start + size], epsilon)[1:]
+            emit_moves(*zip(*kept))
+
+        for cmd_type, x, y, power in commands:
+            if cmd_type == CMD_PA:
+                add_to_run((x, y))
+                continue
+
+            if run:
+                # The run's path starts from wherever the previous move ended
+                emit_run([current] + run)
+                current = run[-1]
+                run.clear()
+
+            if cmd_type == CMD_HOME:
+                current = (0, 0)
+            emit(cmd_type, x, y, power)
+
+        if run:
+            emit_run([current] + run)
+
+        self.commands = simplified
+        return len(commands) - len(simplified)
+
+    def add_points(self, params):
+        """Add a PA move for every x,y pair in an HPGL parameter list (Plot Absolute)"""
+        # Most statements carry a single point; convert it directly rather
+        # than through the arrays parse_coordinates() builds for lists
+        if params.count(b',') == 1:
+            x, _, y = params.partition(b',')
+            try:
+                self.commands.append(CMD_PA, int(x), int(y))
+                return
+            except ValueError:
+                pass  # e.g. "5," or the end of a run; take the general path
+
+        xs, ys = parse_coordinates(params)
+        self.commands.extend_moves(xs, ys)
+
+    def _finalize_bounds(self):
+        """Set the bounds from all PA coordinates in one pass per axis"""
+        commands = self.commands
+        # One byte per command rather than a list of Python objects
+        is_move = bytes(map(CMD_PA.__eq__, commands.types))
+        if not any(is_move):
+            return
+
+        self.min_x = min(compress(commands.xs, is_move))
+        self.max_x = max(compress(commands.xs, is_move))
+        self.min_y = min(compress(commands.ys, is_move))
+        self.max_y = max(compress(commands.ys, is_move))
 
     def get_bounds(self):
         """Get the bounds of the drawing"""
@@ -93,6 +415,6 @@ class HPGLParser:
         return (self.min_x, self.min_y, self.max_x, self.max_y)
 
     def get_commands(self):
-        """Get the parsed commands"""
+        """Get the parsed commands as a CommandStream"""
         return self.commands
 
@@ -1,38 +1,127 @@
+from collections import OrderedDict
 from PyQt6.QtWidgets import QWidget
-from PyQt6.QtGui import QPainter, QColor, QPen
-from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QPainter, QColor, QPen, QPixmap, QTransform
+from PyQt6.QtCore import Qt, QLineF, QTimer
+from GUI.hpgl_parser import CMD_PU, CMD_PD, CMD_PA, CMD_SP
+
+# PyQt6 resolves scoped enums through several attribute lookups; do it once
+_ANTIALIASING = QPainter.RenderHint.Antialiasing
+_DASH_LINE = Qt.PenStyle.DashLine
+
 class HPGLPreview(QWidget):
     """Widget to preview HPGL commands"""
 
+    # Above this many segments antialiased strokes dominate paint time
+    ANTIALIAS_LIMIT = 20000
+
+    # Number of rendered sizes to keep
+    PIXMAP_CACHE_SIZE = 4
+
+    # Milliseconds a resize must settle for before the preview is re-rendered
+    RESIZE_RENDER_DELAY = 100
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.commands = []
         self.bounds = (0, 0, 0, 0)
+        self._lines = {}
+        self._segment_count = 0
+        self._commands_version = 0  # bumped whenever the commands change
+        self._transform = None
+        self._transform_key = None
+        self._pixmaps = OrderedDict()  # (width, height, ratio) -> rendered preview
+
+        # Pens are cosmetic, so their widths stay in pixels under the
+        # drawing's scale transform. Engraving pens are made on first use,
+        # one per laser power level; files rarely use more than a few.
+        self._pens_down = {}  # laser power -> pen
+        self._pen_up = self._cosmetic_pen(QPen(QColor(0, 0, 255, 128), 1, _DASH_LINE))
+
+        # While the user drags the window edge, the last rendering is just
+        # stretched; this renders the final size once the resize settles
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(self.RESIZE_RENDER_DELAY)
+        self._resize_timer.timeout.connect(self.update)
+
         self.setMinimumSize(400, 400)
 
+        # paintEvent covers its whole update region, so skip Qt's background erase
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
     def set_commands(self, commands, bounds):
         """Set the commands to preview"""
         self.commands = commands
         self.bounds = bounds
+        self._commands_version += 1
+        self._lines = self._build_lines(commands)
+        self._segment_count = sum(len(lines) for lines in self._lines.values())
+        self._pixmaps.clear()
         self.update()
 
-    def paintEvent(self, event):
-        """Paint the HPGL preview"""
-        if not self.commands:
-            return
+    def _pen_down(self, laser_power):
+        """Pen for engraved lines, darker red for higher power"""
+        pen = self._pens_down.get(laser_power)
+        if pen is None:
+            level = min(255, max(0, laser_power))
+            pen = self._pens_down[laser_power] = self._cosmetic_pen(QPen(QColor(255 - level, 0, 0), 2))
+        return pen
+
+    @staticmethod
+    def _cosmetic_pen(pen):
+        pen.setCosmetic(True)
+        return pen
+
+    @staticmethod
+    def _build_lines(commands):
+        """Group the drawn segments by (pen_down, laser_power), as lines in
+        HPGL units; the painter maps them to the widget at draw time.
+
+        Connected segments stay separate lines too: the antialiased stroker
+        is far slower on long polylines, especially self-crossing ones.
+        """
+        segments = {}
+        group = segments.setdefault  # looked up once, used for every move
+        line = QLineF
+        pen_down = False
+        current_x, current_y = 0, 0
+        laser_power = 0
 
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        for cmd_type, x, y, power in commands:
+            if cmd_type == CMD_PU:
+                pen_down = False
+            elif cmd_type == CMD_PD:
+                pen_down = True
+            elif cmd_type == CMD_PA:
+                # Movement paths are drawn the same regardless of laser power
+                key = (pen_down, laser_power if pen_down else 0)
+                group(key, []).append(line(current_x, current_y, x, y))
 
-        # Set background
-        painter.fillRect(self.rect(), QColor(240, 240, 240))
+                # Update current position
+                current_x, current_y = x, y
 
+            elif cmd_type == CMD_SP:
+                laser_power = power
+
+        return segments
+
+    def _get_transform(self):
+        """Map HPGL units onto the widget, or None if there is nothing to fit"""
+        # Only the most recent size is kept; repaints at that size reuse it
+        key = (self.width(), self.height(), self._commands_version)
+        if key != self._transform_key:
+            self._transform = self._fit_transform()
+            self._transform_key = key
+        return self._transform
+
+    def _fit_transform(self):
+        """Scale and center the drawing within the widget's margins"""
         # Get drawing bounds
         min_x, min_y, max_x, max_y = self.bounds
 
         # Safety check
         if min_x == max_x or min_y == max_y:
-            return
+            return None
 
         # Calculate scaling to fit widget
         width_margin = self.width() * 0.1
@@ -51,54 +140,77 @@ class HPGLPreview(QWidget):
         offset_x = width_margin + (available_width - scale * (max_x - min_x)) / 2
         offset_y = height_margin + (available_height - scale * (max_y - min_y)) / 2
 
-        # Transform coordinates
-        def transform_x(x):
-            return offset_x + scale * (x - min_x)
-
-        def transform_y(y):
-            # Invert Y axis because screen coordinates go down
-            return self.height() - (offset_y + scale * (y - min_y))
+        # x' = a_x + scale * x, y' = a_y - scale * y
+        # (the Y axis is inverted because screen coordinates go down)
+        a_x = offset_x - scale * min_x
+        a_y = self.height() - offset_y + scale * min_y
+        return QTransform(scale, 0, 0, -scale, a_x, a_y)
 
-        # Draw commands
-        pen_down = False
-        current_x, current_y = 0, 0
-        laser_power = 0
+    def paintEvent(self, event):
+        """Paint the HPGL preview"""
+        # Nothing on screen to refresh
+        if not self.isVisible() or event.region().isEmpty():
+            return
 
-        for cmd in self.commands:
-            cmd_type = cmd['type']
+        painter = QPainter(self)
+        if not self.commands:
+            painter.fillRect(event.rect(), self.palette().window())
+            return
 
-            if cmd_type == 'PU':
-                pen_down = False
-            elif cmd_type == 'PD':
-                pen_down = True
-            elif cmd_type == 'PA':
-                new_x, new_y = cmd['x'], cmd['y']
-
-                if pen_down:
-                    # Draw line with intensity based on laser power
-                    intensity = min(255, max(0, laser_power))
-                    color = QColor(255 - intensity, 0, 0)  # Darker red for higher power
-                    pen = QPen(color, 2)
-                    painter.setPen(pen)
-
-                    # Draw line
-                    painter.drawLine(
-                        int(transform_x(current_x)), int(transform_y(current_y)),
-                        int(transform_x(new_x)), int(transform_y(new_y))
-                    )
-                else:
-                    # Draw movement path as dashed line
-                    pen = QPen(QColor(0, 0, 255, 128), 1, Qt.PenStyle.DashLine)
-                    painter.setPen(pen)
-
-                    # Draw line
-                    painter.drawLine(
-                        int(transform_x(current_x)), int(transform_y(current_y)),
-                        int(transform_x(new_x)), int(transform_y(new_y))
-                    )
+        # Render the drawing once per size, then just blit the damaged area.
+        # A few sizes are kept so toggling between window states stays cheap.
+        key = (self.width(), self.height(), self.devicePixelRatioF())
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None and self._pixmaps and self._resize_timer.isActive():
+            # Mid-resize: stretch the latest rendering rather than render
+            # every intermediate size
+            latest = next(reversed(self._pixmaps.values()))
+            painter.drawPixmap(self.rect(), latest)
+            return
+        if pixmap is None:
+            pixmap = self._pixmaps[key] = self._render()
+            if len(self._pixmaps) > self.PIXMAP_CACHE_SIZE:
+                self._pixmaps.popitem(last=False)
+        else:
+            self._pixmaps.move_to_end(key)
+
+        painter.setClipRegion(event.region())
+        painter.drawPixmap(0, 0, pixmap)
+
+    def resizeEvent(self, event):
+        """Hold off re-rendering until the size settles"""
+        if self._pixmaps:
+            self._resize_timer.start()
+        super().resizeEvent(event)
+
+    def _render(self):
+        """Render the full preview into an offscreen pixmap"""
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(round(self.width() * ratio), round(self.height() * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(_ANTIALIASING, self._segment_count <= self.ANTIALIAS_LIMIT)
 
-                # Update current position
-                current_x, current_y = new_x, new_y
+        # Set background
+        painter.fillRect(self.rect(), QColor(240, 240, 240))
 
-            elif cmd_type == 'SP':
-                laser_power = cmd['power']
+        transform = self._get_transform()
+        if transform is None:
+            painter.end()
+            return pixmap
+        painter.setTransform(transform)
+
+        # Draw movement paths first so engraved lines stay on top; one
+        # drawLines() call per pen
+        for (pen_down, laser_power), lines in sorted(self._lines.items()):
+            if pen_down:
+                # Draw line with intensity based on laser power
+                painter.setPen(self._pen_down(laser_power))
+            else:
+                # Draw movement path as dashed line
+                painter.setPen(self._pen_up)
+            painter.drawLines(lines)
+
+        painter.end()
+        return pixmap
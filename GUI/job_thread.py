@@ -1,80 +1,285 @@
+import queue
+import threading
 import time
+from array import array
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
 from PyQt6.QtCore import QThread,pyqtSignal
+from GUI.hpgl_parser import CMD_HOME, CMD_PU, CMD_PD, CMD_PA, CMD_SP
+
+# Wire format of the commands that take no parameters
+_BARE_COMMANDS = {CMD_HOME: b'HOME:\n', CMD_PU: b'PU:\n', CMD_PD: b'PD:\n'}
+
+# Status message for command i of a stream, indexed by command type
+_STATUS_MESSAGES = (
+    lambda commands, i: "Homing machine...",  # CMD_HOME
+    lambda commands, i: "Laser OFF",  # CMD_PU
+    lambda commands, i: "Laser ON",  # CMD_PD
+    lambda commands, i: f"Moving to ({commands.xs[i]}, {commands.ys[i]})",  # CMD_PA
+    lambda commands, i: f"Setting laser power to {commands.powers[i]}",  # CMD_SP
+)
+_HOME_BYTE = bytes([CMD_HOME])
+_PU_BYTE = bytes([CMD_PU])
+_PD_BYTE = bytes([CMD_PD])
+
+
+def encode_commands(commands):
+    """Encode a CommandStream in the Arduino's wire format.
+
+    Returns the concatenated bytes and the offset of every command in them:
+    command i is data[offsets[i]:offsets[i + 1]].
+    """
+    parts = []
+    append = parts.append
+    for cmd_type, x, y, power in commands:
+        if cmd_type == CMD_PA:
+            append(b'PA:%d,%d\n' % (x, y))
+        elif cmd_type == CMD_SP:
+            append(b'SP:%d\n' % power)
+        else:
+            append(_BARE_COMMANDS[cmd_type])
+
+    offsets = array('l', accumulate(map(len, parts), initial=0))
+    return b''.join(parts), offsets
+
+
 class JobThread(QThread):
     """Thread to run the engraving job"""
-    progress_update = pyqtSignal(int)
-    status_update = pyqtSignal(str)
     job_finished = pyqtSignal()
 
-    def __init__(self, arduino, commands):
+    # Size of the Arduino UNO's hardware serial RX buffer. The firmware stops
+    # reading while a move is in progress, so unacknowledged bytes must fit.
+    RX_BUFFER_SIZE = 64
+
+    # Minimum seconds between per-command status messages
+    STATUS_INTERVAL = 0.05
+
+    # Seconds without any response before the Arduino is given up on; well
+    # above the longest move, so only a lost ACK or a dead link gets here
+    ACK_TIMEOUT = 30
+
+    def __init__(self, arduino, commands, window_size=16, wire=None):
         super().__init__()
         self.arduino = arduino
         self.commands = commands
+        self.window_size = window_size  # most commands awaiting an ACK at once
         self.is_running = False
-        self.is_paused = False
+        self.laser_on = False
+        self._run_event = threading.Event()  # cleared while paused
+        self._run_event.set()
+        self._stop_event = threading.Event()
+        self._outstanding = deque()  # (length, progress) of unacknowledged commands
+        self._outstanding_bytes = 0
+        self._responses = deque()  # lines read but not yet handled
+        self._last_status = 0.0
+        self._last_progress = -1
+
+        # (progress, status) updates for the GUI to poll; either may be None.
+        # Bounded so a busy GUI thread can never hold up the serial stream.
+        self.updates = queue.Queue(maxsize=16)
+
+        # The whole job is encoded up front so the send loop only slices
+        # bytes; wire is encode_commands(commands) if the caller has it already
+        self._wire, self._offsets = wire if wire is not None else encode_commands(commands)
 
     def run(self):
         """Run the engraving job"""
         self.is_running = True
-        self.is_paused = False
+        self._stop_event.clear()
+        self._run_event.set()
+        self.laser_on = False
+        self._last_status = 0.0
+        self._last_progress = -1
+        self._outstanding.clear()
+        self._outstanding_bytes = 0
+        self._responses.clear()
         total_commands = len(self.commands)
+        offsets = self._offsets
 
         try:
-            for i, cmd in enumerate(self.commands):
+            # Anything already waiting belongs to an earlier job or command;
+            # an old ACK taken for one of this job's would overfill the RX buffer
+            self.arduino.reset_input()
+
+            i = 0
+            while i < total_commands:
                 # Check if job is paused
-                while self.is_paused and self.is_running:
-                    time.sleep(0.1)
+                if not self._run_event.is_set():
+                    self._hold()
 
                 # Check if job was canceled
-                if not self.is_running:
+                if self._stop_event.is_set():
                     break
 
-                # Send command to Arduino
-                cmd_type = cmd['type']
-                if cmd_type == 'HOME':
-                    self.arduino.send_command('HOME:')
-                    self.status_update.emit("Homing machine...")
-                elif cmd_type == 'PU':
-                    self.arduino.send_command('PU:')
-                    self.status_update.emit("Laser OFF")
-                elif cmd_type == 'PD':
-                    self.arduino.send_command('PD:')
-                    self.status_update.emit("Laser ON")
-                elif cmd_type == 'PA':
-                    x, y = cmd['x'], cmd['y']
-                    self.arduino.send_command(f'PA:{x},{y}')
-                    self.status_update.emit(f"Moving to ({x}, {y})")
-                elif cmd_type == 'SP':
-                    power = cmd['power']
-                    self.arduino.send_command(f'SP:{power}')
-                    self.status_update.emit(f"Setting laser power to {power}")
-
-                # Wait for Arduino to process command
-                response = self.arduino.wait_for_response()
-                if response and response.startswith("ERR"):
-                    self.status_update.emit(f"Error: {response}")
-
-                # Update progress
-                progress = int((i + 1) / total_commands * 100)
-                self.progress_update.emit(progress)
-
-            # Turn off laser at end of job
-            self.arduino.send_command('PU:')
-            self.status_update.emit("Job completed")
+                # Take as many commands as fit in the Arduino's free RX buffer
+                # and the window
+                free = self.RX_BUFFER_SIZE - self._outstanding_bytes
+                end = bisect_right(offsets, offsets[i] + free, i, total_commands + 1) - 1
+                end = min(end, i + self.window_size - len(self._outstanding))
+
+                if end <= i:
+                    # Buffer or window is full; wait for the oldest command to
+                    # finish, then take every other ACK that came with it so
+                    # the freed space is refilled in one write, not one per ACK
+                    self._receive_ack()
+                    while self._outstanding and self._receive_ack(block=False):
+                        pass
+                    continue
+
+                # Ship the batch in a single write; progress is reported once
+                # the Arduino acknowledges each command
+                self.arduino.send_command_raw(self._wire[offsets[i]:offsets[end]])
+                for j in range(i, end):
+                    length = offsets[j + 1] - offsets[j]
+                    self._outstanding.append((length, int((j + 1) / total_commands * 100)))
+                    self._outstanding_bytes += length
+                self._report_sent(i, end)
+                i = end
+
+            # Let the Arduino work through the streamed commands. A stopped job
+            # waits for them too, so none of their ACKs is left for the next job.
+            self._drain()
+
+            # Turn off laser and return to the origin; the move can take far
+            # longer than the port timeout, so it is waited for here too
+            self._send(b'PU:\n')
+            self._send(b'PA:0,0\n')
+            self._drain()
+            self._post(status="Job completed")
         except Exception as e:
-            self.status_update.emit(f"Error: {str(e)}")
+            self._post(status=f"Error: {str(e)}")
+            self._force_laser_off()
         finally:
             self.is_running = False
             self.job_finished.emit()
 
+    def _report_sent(self, start, end):
+        """Track laser state and report commands start to end - 1 once they are streamed"""
+        commands = self.commands
+        # Scanned in C instead of looking at each command type in turn
+        batch = commands.types[start:end].tobytes()
+
+        # The last pen command in the batch decides the laser state
+        last_pen = max(batch.rfind(_PU_BYTE), batch.rfind(_PD_BYTE))
+        if last_pen >= 0:
+            self.laser_on = batch[last_pen] == CMD_PD
+
+        # Commands stream far faster than anyone can read the label; it only
+        # needs to look alive, so at most one command per batch is shown and
+        # most messages are never even formatted. Homing is always shown.
+        now = time.monotonic()
+        home = batch.rfind(_HOME_BYTE)
+        if home >= 0:
+            i = start + home
+        elif now - self._last_status < self.STATUS_INTERVAL:
+            return
+        else:
+            i = end - 1
+        self._last_status = now
+        self._post(status=_STATUS_MESSAGES[batch[i - start]](commands, i))
+
+    def _post(self, progress=None, status=None):
+        """Queue an update for the GUI, dropping the oldest one if it is behind"""
+        while True:
+            try:
+                self.updates.put_nowait((progress, status))
+                return
+            except queue.Full:
+                try:
+                    self.updates.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _send(self, data, progress=None):
+        """Stream a command, blocking only while it would overflow the Arduino's RX buffer"""
+        while self._outstanding and (self._outstanding_bytes + len(data) > self.RX_BUFFER_SIZE
+                                     or len(self._outstanding) >= self.window_size):
+            self._receive_ack()
+
+        self.arduino.send_command_raw(data)
+        self._outstanding.append((len(data), progress))
+        self._outstanding_bytes += len(data)
+
+    def _receive_ack(self, block=True):
+        """Read responses until the oldest outstanding command is acknowledged.
+
+        With block=False only responses already read are looked at; returns
+        False if they hold no ACK. Raises TimeoutError if the Arduino stays
+        silent for ACK_TIMEOUT seconds.
+        """
+        last_response = time.monotonic()
+        while True:
+            if not self._responses:
+                if not block:
+                    return False
+                # One read picks up every ACK that has arrived since the last one
+                self._responses.extend(self.arduino.read_lines())
+                if not self._responses:
+                    # Long moves can outlast the serial timeout, but not ACK_TIMEOUT
+                    if time.monotonic() - last_response > self.ACK_TIMEOUT:
+                        raise TimeoutError(f"No response from Arduino for {self.ACK_TIMEOUT} s")
+                    continue
+                last_response = time.monotonic()
+
+            response = self._responses.popleft()
+
+            # The firmware finishes every command with an ACK, even after
+            # reporting an error such as an out-of-bounds move
+            if response.startswith("ACK"):
+                break
+            if response.startswith("ERR"):
+                self._post(status=f"Error: {response}")
+
+        length, progress = self._outstanding.popleft()
+        self._outstanding_bytes -= length
+        if progress is not None and progress != self._last_progress:
+            self._last_progress = progress
+            self._post(progress=progress)
+        return True
+
+    def _force_laser_off(self):
+        """Send a PU without waiting for room or an ACK, so an aborted job
+        doesn't leave the laser on"""
+        try:
+            self.arduino.send_command_raw(b'PU:\n')
+            self.laser_on = False
+        except Exception:
+            pass  # e.g. the board was unplugged
+
+    def _drain(self):
+        """Wait until every streamed command has been acknowledged"""
+        while self._outstanding:
+            self._receive_ack()
+
+    def _hold(self):
+        """Keep the laser off while the job is paused"""
+        self._drain()
+        if self.laser_on:
+            self._send(b'PU:\n')
+            self._drain()
+
+        # Sleep until resumed; stop() also wakes this up
+        self._run_event.wait()
+
+        # Pick up where the job left off
+        if not self._stop_event.is_set() and self.laser_on:
+            self._send(b'PD:\n')
+
+    @property
+    def is_paused(self):
+        """Check if the job is paused"""
+        return not self._run_event.is_set()
+
     def pause(self):
         """Pause the job"""
-        self.is_paused = True
+        self._run_event.clear()
 
     def resume(self):
         """Resume the job"""
-        self.is_paused = False
+        self._run_event.set()
 
     def stop(self):
         """Stop the job"""
-        self.is_running = False
\ No newline at end of file
+        self._stop_event.set()
+        self._run_event.set()
@@ -1,8 +1,11 @@
+import logging
 import sys
 from PyQt6.QtWidgets import QApplication
 from GUI.main_window import MainWindow
 
 def main():
+    # Raise to DEBUG to follow button presses and job updates on the console
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(message)s")
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
@@ -1,16 +1,20 @@
+import logging
 import os
-import time
+import queue
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QPushButton, QLabel,
     QFileDialog, QComboBox, QSlider, QMessageBox, QGroupBox,
-    QGridLayout, QProgressBar, QHBoxLayout
+    QGridLayout, QProgressBar, QHBoxLayout, QApplication
 )
 from GUI.arduino_controller import ArduinoController
 from GUI.hpgl_parser import HPGLParser
 from GUI.hpgl_preview import HPGLPreview
 from GUI.job_thread import JobThread
+from GUI.parse_thread import ParseThread
+
+logger = logging.getLogger(__name__)
 
 
 class MainWindow(QMainWindow):
@@ -22,7 +26,15 @@ class MainWindow(QMainWindow):
         # Initialize components
         self.arduino = ArduinoController()
         self.hpgl_parser = HPGLParser()
+        self.job_wire = None  # hpgl_parser's commands in the Arduino's wire format
         self.job_thread = None
+        self.parse_thread = None
+        self.test_firing = False  # laser is on until end_test_fire()
+
+        # Applies the job thread's queued progress/status updates
+        self.job_update_timer = QTimer(self)
+        self.job_update_timer.setInterval(100)
+        self.job_update_timer.timeout.connect(self.poll_job_updates)
 
         # Set up UI
         self.setWindowTitle("HPGL Laser Engraver Control")
@@ -155,83 +167,142 @@ class MainWindow(QMainWindow):
 
     def refresh_ports(self):
         """Refresh list of available serial ports"""
-        print("[GUI] Refreshing serial ports…")
+        logger.debug("Refreshing serial ports")
         self.port_combo.clear()
         ports = self.arduino.get_available_ports()
-        print(f"[GUI]  → found ports: {ports}")
+        logger.debug("Found ports: %s", ports)
         self.port_combo.addItems(ports)
 
     def toggle_connection(self):
         """Connect or disconnect from Arduino"""
         if self.arduino.is_connected():
-            print("[GUI] Disconnecting from Arduino")
+            logger.debug("Disconnecting from Arduino")
+            # Never leave the laser on behind a closed port
+            try:
+                self.arduino.send_command("PU:")
+                logger.debug("Ack: %s", self.arduino.wait_for_response())
+            except Exception as e:
+                logger.warning("Failed to turn the laser off: %s", e)
             self.arduino.disconnect()
-            print("[GUI]  → Disconnected")
+            logger.debug("Disconnected")
             self.connect_button.setText("Connect")
             self.status_label.setText("Disconnected")
         else:
             # Connect
             port = self.port_combo.currentText()
-            print(f"[GUI] Connecting to Arduino on port {port}")
+            logger.debug("Connecting to Arduino on port %s", port)
             if not port:
-                print("[GUI]  → No port selected!")
+                logger.warning("No port selected")
                 QMessageBox.warning(self, "Error", "No port selected")
                 return
 
             success = self.arduino.connect(port)
-            print(f"[GUI]  → connect() returned {success}")
+            logger.debug("connect() returned %s", success)
             if success:
                 self.connect_button.setText("Disconnect")
                 self.status_label.setText("Connected")
-                self.start_button.setEnabled(self.file_path_label.text() != "No file selected")
+                self.update_start_button()
             else:
-                print(f"[GUI]  → Failed to connect to {port}")
+                logger.warning("Failed to connect to %s", port)
                 QMessageBox.warning(self, "Error", f"Failed to connect to {port}")
 
     def open_file(self):
-        print("[GUI] Opening HPGL file…")
+        logger.debug("Opening HPGL file")
         path, _ = QFileDialog.getOpenFileName(self, "Open HPGL File", "", "HPGL Files (*.hpgl *.plt);;All Files (*.*)")
-        print(f"[GUI]  → user selected: {path}")
+        logger.debug("User selected: %s", path)
         if not path:
-            print("[GUI]  → no file chosen, aborting")
+            logger.debug("No file chosen")
             return
 
-        ok = self.hpgl_parser.parse_file(path)
-        print(f"[GUI]  → parse_file returned {ok}")
+        # Parse in the background; file_parsed() picks up the result
+        self.open_file_button.setEnabled(False)
+        self.start_button.setEnabled(False)
+        self.status_label.setText("Loading file...")
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+
+        self.parse_thread = ParseThread(path)
+        self.parse_thread.parse_finished.connect(self.file_parsed)
+        self.parse_thread.start()
+
+    def file_parsed(self, ok):
+        """Called when the parse thread is done with a file"""
+        QApplication.restoreOverrideCursor()
+        self.open_file_button.setEnabled(True)
+        thread = self.parse_thread
+        # The signal is the last thing run() does; once the thread has
+        # returned, update_start_button() no longer sees it as running
+        thread.wait()
+
+        logger.debug("parse_file returned %s", ok)
         if ok:
+            logger.debug("simplify() dropped %d redundant moves", thread.removed)
+            self.hpgl_parser = thread.parser
+            self.job_wire = thread.wire
             commands = self.hpgl_parser.get_commands()
             bounds = self.hpgl_parser.get_bounds()
-            print(f"[GUI]  → parsed {len(commands)} commands, bounds = {bounds}")
+            logger.debug("Parsed %d commands, bounds = %s", len(commands), bounds)
             self.preview_widget.set_commands(commands, bounds)
-            self.file_path_label.setText(os.path.basename(path))
-            self.start_button.setEnabled(self.arduino.is_connected())
+            self.file_path_label.setText(os.path.basename(thread.path))
+            self.status_label.setText("File loaded")
+            self.update_start_button()
         else:
-            print("[GUI]  → parse failed")
+            logger.warning("Failed to parse %s", thread.path)
+            self.status_label.setText("Ready")
+            # The previously loaded file, if any, is still there to run
+            self.update_start_button()
             QMessageBox.warning(self, "Error", "Failed to parse HPGL file")
 
     def update_laser_power(self):
         val = self.laser_power_slider.value()
-        print(f"[GUI] Laser power slider changed → {val}")
+        logger.debug("Laser power slider changed to %d", val)
         self.laser_power_value.setText(str(val))
 
     def test_laser(self):
-        print("[GUI] Test Laser pressed")
+        logger.debug("Test Laser pressed")
         try:
             power = self.laser_power_slider.value()
-            print(f"[GUI]  → sending SP:{power}")
+            logger.debug("Sending SP:%d", power)
             self.arduino.send_command(f"SP:{power}")
-            print("[GUI]  ← ack:", self.arduino.wait_for_response())
+            logger.debug("Ack: %s", self.arduino.wait_for_response())
 
-            print("[GUI]  → sending PD:")
+            logger.debug("Sending PD:")
             self.arduino.send_command("PD:")
-            print("[GUI]  ← ack:", self.arduino.wait_for_response())
+            logger.debug("Ack: %s", self.arduino.wait_for_response())
+
+            # Let the event loop run while the laser fires instead of sleeping.
+            # Nothing else may use the port or take the laser over until
+            # end_test_fire() has turned it off again.
+            self.test_firing = True
+            self.laser_test_button.setEnabled(False)
+            self.start_button.setEnabled(False)
+            self.connect_button.setEnabled(False)
+            QTimer.singleShot(1000, self.end_test_fire)
+        except Exception as e:
+            logger.warning("Test Laser error: %s", e)
 
-            time.sleep(1)
-            print("[GUI]  → sending PU:")
+    def end_test_fire(self):
+        """Turn the laser off again after a test fire"""
+        try:
+            logger.debug("Sending PU:")
             self.arduino.send_command("PU:")
-            print("[GUI]  ← ack:", self.arduino.wait_for_response())
+            logger.debug("Ack: %s", self.arduino.wait_for_response())
         except Exception as e:
-            print("[GUI]  → Test Laser error:", e)
+            logger.warning("Test Laser error: %s", e)
+
+        self.test_firing = False
+        self.laser_test_button.setEnabled(True)
+        self.connect_button.setEnabled(True)
+        self.update_start_button()
+
+    def update_start_button(self):
+        """Enable Start only while a loaded file could be run right now"""
+        # The file may be about to change under a parse, and two jobs, or a
+        # job and a test fire, must never share the port
+        busy = ((self.parse_thread and self.parse_thread.isRunning())
+                or (self.job_thread and self.job_thread.is_running)
+                or self.test_firing)
+        self.start_button.setEnabled(not busy and self.arduino.is_connected()
+                                     and self.file_path_label.text() != "No file selected")
 
     def start_job(self):
         """Start the engraving job"""
@@ -239,19 +310,18 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Error", "Not connected to Arduino")
             return
 
-        print("[GUI] Start Job pressed")
+        logger.debug("Start Job pressed")
         commands = self.hpgl_parser.get_commands()
-        print(f"[GUI]  → {len(commands)} commands to execute")
+        logger.debug("%d commands to execute", len(commands))
         if not commands:
             QMessageBox.warning(self, "Error", "No valid commands to execute")
             return
 
         # Create and start job thread
-        self.job_thread = JobThread(self.arduino, commands)
-        self.job_thread.progress_update.connect(self.update_progress)
-        self.job_thread.status_update.connect(self.update_status)
+        self.job_thread = JobThread(self.arduino, commands, wire=self.job_wire)
         self.job_thread.job_finished.connect(self.job_finished)
         self.job_thread.start()
+        self.job_update_timer.start()
 
         # Update UI
         self.start_button.setEnabled(False)
@@ -259,6 +329,14 @@ class MainWindow(QMainWindow):
         self.pause_button.setText("Pause")
         self.stop_button.setEnabled(True)
         self.open_file_button.setEnabled(False)
+        # The job thread owns the port; anything else reading from it could
+        # take one of the job's ACKs
+        self.laser_test_button.setEnabled(False)
+        self.connect_button.setEnabled(False)
+
+        # The drawing cannot change mid-job; keep progress/status updates
+        # from dragging the preview into every repaint
+        self.preview_widget.setUpdatesEnabled(False)
 
     def toggle_pause(self):
         """Pause or resume the job"""
@@ -267,70 +345,90 @@ class MainWindow(QMainWindow):
 
         if self.job_thread.is_paused:
             # Resume
-            print("[GUI] Resuming job")
+            logger.debug("Resuming job")
             self.job_thread.resume()
             self.pause_button.setText("Pause")
             self.status_label.setText("Job resumed")
         else:
-            # Pause
-            self.arduino.send_command("PU")
-            self.arduino.wait_for_response()
-            print("[GUI] Pausing job")
+            # Pause; the job thread turns the laser off once streamed commands finish
+            logger.debug("Pausing job")
             self.job_thread.pause()
             self.pause_button.setText("Resume")
             self.status_label.setText("Job paused")
 
     def stop_job(self):
         """Stop the engraving job"""
-        print("[GUI] Stop Job pressed")
+        logger.debug("Stop Job pressed")
         if not self.job_thread:
             return
 
         self.job_thread.stop()
         self.status_label.setText("Job stopped")
 
+    def poll_job_updates(self):
+        """Apply only the latest of the updates queued by the job thread"""
+        if not self.job_thread:
+            return
+
+        progress = status = None
+        while True:
+            try:
+                item_progress, item_status = self.job_thread.updates.get_nowait()
+            except queue.Empty:
+                break
+            if item_progress is not None:
+                progress = item_progress
+            if item_status is not None:
+                status = item_status
+
+        if progress is not None:
+            self.update_progress(progress)
+        if status is not None:
+            self.update_status(status)
+
     def update_progress(self, progress):
         """Update progress bar"""
-        print(f"[GUI] Job progress: {progress}%")
+        logger.debug("Job progress: %d%%", progress)
         self.progress_bar.setValue(progress)
 
     def update_status(self, status):
         """Update status label"""
-        print(f"[GUI] Job status: {status}")
+        logger.debug("Job status: %s", status)
         self.status_label.setText(status)
 
     def job_finished(self):
         """Called when job is finished"""
-        print("[GUI] Job finished")
+        logger.debug("Job finished")
+        self.job_update_timer.stop()
+        self.poll_job_updates()
+
         # Reset UI
-        self.start_button.setEnabled(True)
+        self.update_start_button()
         self.pause_button.setEnabled(False)
         self.stop_button.setEnabled(False)
         self.open_file_button.setEnabled(True)
+        self.laser_test_button.setEnabled(True)
+        self.connect_button.setEnabled(True)
         self.progress_bar.setValue(0)
-
-        # Make sure laser is off
-        if self.arduino.is_connected():
-            try:
-                self.arduino.send_command("PU")
-                self.arduino.wait_for_response()
-                self.arduino.send_command(f'PA:0,0')
-                self.arduino.wait_for_response()
-
-            except:
-                pass
+        self.preview_widget.setUpdatesEnabled(True)
+        self.preview_widget.update()
 
     def closeEvent(self, event):
         """Handle window close event"""
-        # Stop job if running
+        # Parsing can't be interrupted, but the thread must not outlive the window
+        if self.parse_thread and self.parse_thread.isRunning():
+            self.parse_thread.wait()
+
+        # Stop job if running; it still waits for the streamed commands and
+        # turns the laser off, and must not share the port with the PU below
         if self.job_thread and self.job_thread.is_running:
             self.job_thread.stop()
-            self.job_thread.wait(1000)
+            self.job_thread.wait()
 
         # Turn off laser and disconnect
         if self.arduino.is_connected():
             try:
-                self.arduino.send_command("PU")
+                self.arduino.send_command("PU:")
                 self.arduino.wait_for_response()
                 self.arduino.disconnect()
             except:
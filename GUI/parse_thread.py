@@ -0,0 +1,27 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+from GUI.hpgl_parser import HPGLParser
+from GUI.job_thread import encode_commands
+
+
+class ParseThread(QThread):
+    """Thread to parse an HPGL file without blocking the GUI"""
+    parse_finished = pyqtSignal(bool)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        # A parser of its own, so the one the GUI holds stays usable until
+        # the new file is ready
+        self.parser = HPGLParser()
+        self.removed = 0
+        self.wire = None  # encode_commands() result for the parsed file
+
+    def run(self):
+        """Parse, simplify and encode the file"""
+        ok = self.parser.parse_file(self.path)
+        if ok:
+            # Redundant points cost a full planner round trip each on the Arduino
+            self.removed = self.parser.simplify()
+            # Encoding here keeps it off the GUI thread when the job starts
+            self.wire = encode_commands(self.parser.get_commands())
+        self.parse_finished.emit(ok)
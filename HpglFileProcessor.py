@@ -5,240 +5,185 @@ HPGL File Processor - Standalone utility for processing HPGL files
 import sys
 import os
 import argparse
-import re
 import math
+from array import array
+from functools import lru_cache
 
+from GUI.hpgl_parser import HPGLParser, PWM_TO_SP, CMD_HOME, CMD_PU, CMD_PD, CMD_PA, CMD_SP
 
-class HPGLProcessor:
+
+@lru_cache(maxsize=None)
+def _unit_circle(segments):
+    """cos and sin of every step around a circle, excluding the start point"""
+    angles = [2 * math.pi * i / segments for i in range(1, segments)]  # radians
+    return tuple(map(math.cos, angles)), tuple(map(math.sin, angles))
+
+
+class HPGLProcessor(HPGLParser):
     """
-    Standalone utility for parsing and processing HPGL files
+    Standalone utility for parsing and processing HPGL files.
+
+    Parsing is shared with the GUI's HPGLParser; this adds circles and the
+    command line transforms and output formats.
     """
 
-    def __init__(self):
-        self.commands = []
-        self.min_x = float('inf')
-        self.min_y = float('inf')
-        self.max_x = float('-inf')
-        self.max_y = float('-inf')
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        super().__init__()
+        self._dispatch[b'CI'] = self._parse_ci
 
     def parse_file(self, filename):
         """Parse an HPGL file into commands"""
         print(f"Parsing HPGL file: {filename}")
 
-        try:
-            with open(filename, 'r') as f:
-                content = f.read()
-
-            # Remove any whitespace
-            content = content.replace(' ', '').replace('\n', '').replace('\r', '')
-
-            # Split by semicolons to get commands
-            raw_commands = content.split(';')
-            command_count = 0
-
-            for cmd in raw_commands:
-                if not cmd:
-                    continue
-
-                # Extract command type (first two characters)
-                cmd_type = cmd[:2]
-                command_count += 1
-
-                if cmd_type == 'IN':
-                    # Initialize
-                    self.commands.append({'type': 'HOME'})
-                    print("  Found: Initialize (IN)")
-                elif cmd_type == 'PU':
-                    # Pen Up (Laser Off)
-                    self.commands.append({'type': 'PU'})
-                    print("  Found: Pen Up (PU)")
-
-                    # Check if coordinates follow
-                    if len(cmd) > 2:
-                        nums = list(map(int, cmd[2:].split(',')))
-                        # consume pairs (x,y) in order
-                        for i in range(0, len(nums) - 1, 2):
-                            x, y = nums[i], nums[i + 1]
-                            self.update_bounds(x, y)
-                            self.commands.append({'type': 'PA', 'x': x, 'y': y})
-                            print(f"  Found: Move to ({x}, {y})")
-
-                elif cmd_type == 'PD':
-                    # Pen Down (Laser On)
-                    self.commands.append({'type': 'PD'})
-                    print("  Found: Pen Down (PD)")
-
-                    # Check if coordinates follow
-                    if len(cmd) > 2:
-                        nums = list(map(int, cmd[2:].split(',')))
-                        # consume pairs (x,y) in order
-                        for i in range(0, len(nums) - 1, 2):
-                            x, y = nums[i], nums[i + 1]
-                            self.update_bounds(x, y)
-                            self.commands.append({'type': 'PA', 'x': x, 'y': y})
-                            print(f"  Found: Move to ({x}, {y})")
-
-                elif cmd_type == 'PA':
-                    # Plot Absolute — may have multiple x,y pairs in one statement
-                    nums = [int(n) for n in cmd[2:].split(',') if n]
-                    for i in range(0, len(nums) - 1, 2):
-                        x, y = nums[i], nums[i + 1]
-                        self.update_bounds(x, y)
-                        self.commands.append({'type': 'PA', 'x': x, 'y': y})
-                        print(f"  Found: Plot Absolute to ({x}, {y})")
-
-                elif cmd_type == 'SP':
-                    # Select Pen (Laser Power)
-                    if len(cmd) > 2:
-                        pen = int(cmd[2:])
-                        # Scale pen from HPGL (0-8) to PWM (0-255)
-                        power = min(255, int((pen / 8) * 255))
-                        self.commands.append({'type': 'SP', 'power': power})
-                        print(f"  Found: Select Pen {pen} (Power: {power})")
-                elif cmd_type == 'CI':
-                    # Circle
-                    radius = int(cmd[2:])
-                    print(f"  Found: Circle with radius {radius}")
-                    # Convert circle to line segments
-                    self.convert_circle_to_lines(radius)
-
-            print(f"Parsed {command_count} HPGL commands")
+        if not super().parse_file(filename):
+            return False
+
+        # One summary instead of a line per command
+        counts = self.statement_counts
+        print(f"Parsed {sum(counts.values())} HPGL commands: "
+              f"PA={self.commands.types.count(CMD_PA)} PU={counts[b'PU']} "
+              f"PD={counts[b'PD']} SP={counts[b'SP']} CI={counts[b'CI']}")
+        if self.verbose:
             print(f"Drawing bounds: ({self.min_x}, {self.min_y}) to ({self.max_x}, {self.max_y})")
 
-            return True
-        except Exception as e:
-            print(f"Error parsing HPGL file: {e}")
-            return False
+        return True
 
-    def update_bounds(self, x, y):
-        """Update the bounds of the drawing"""
-        self.min_x = min(self.min_x, x)
-        self.min_y = min(self.min_y, y)
-        self.max_x = max(self.max_x, x)
-        self.max_y = max(self.max_y, y)
+    def _parse_ci(self, params):
+        """Circle, converted to line segments around the current point"""
+        self.convert_circle_to_lines(int(params))
 
     def convert_circle_to_lines(self, radius, segments=36):
         """Convert a circle to line segments"""
         # Get the last point as the center
-        if self.commands and self.commands[-1]['type'] == 'PA':
-            center_x = self.commands[-1]['x']
-            center_y = self.commands[-1]['y']
-
+        commands = self.commands
+        if commands and commands.types[-1] == CMD_PA:
             # Remove the center point
-            self.commands.pop()
+            _, center_x, center_y, _ = commands.pop()
 
             # Add pen up to move to first point
-            self.commands.append({'type': 'PU'})
+            self.set_pen(False)
 
             # Calculate first point
             first_x = center_x + radius
             first_y = center_y
 
             # Move to first point
-            self.commands.append({'type': 'PA', 'x': first_x, 'y': first_y})
-            self.update_bounds(first_x, first_y)
+            self.commands.append(CMD_PA, first_x, first_y)
 
             # Put pen down to draw
-            self.commands.append({'type': 'PD'})
+            self.set_pen(True)
 
-            # Create points around the circle
-            for i in range(1, segments + 1):
-                angle = 2 * math.pi * i / segments  # convert to radian
-                x = center_x + int(radius * math.cos(angle))
-                y = center_y + int(radius * math.sin(angle))
+            # Create points around the circle from the cached unit circle,
+            # added to the command arrays in bulk
+            cos_table, sin_table = _unit_circle(segments)
+            self.commands.extend_moves([center_x + round(radius * c) for c in cos_table],
+                                       [center_y + round(radius * s) for s in sin_table])
 
-                self.commands.append({'type': 'PA', 'x': x, 'y': y})
-                self.update_bounds(x, y)
+            # Close the circle exactly on the first point
+            self.commands.append(CMD_PA, first_x, first_y)
 
             # Add pen up at the end
-            self.commands.append({'type': 'PU'})
+            self.set_pen(False)
 
     def scale_commands(self, scale_factor):
         """Scale all coordinates by a factor"""
         print(f"Scaling by factor {scale_factor}")
-
-        scaled_commands = []
-
-        for cmd in self.commands:
-            if cmd['type'] == 'PA':
-                scaled_cmd = cmd.copy()
-                scaled_cmd['x'] = int(cmd['x'] * scale_factor)
-                scaled_cmd['y'] = int(cmd['y'] * scale_factor)
-                scaled_commands.append(scaled_cmd)
-            else:
-                scaled_commands.append(cmd)
-
-        # Update bounds
-        self.min_x = self.min_x * scale_factor
-        self.min_y = self.min_y * scale_factor
-        self.max_x = self.max_x * scale_factor
-        self.max_y = self.max_y * scale_factor
-
-        self.commands = scaled_commands
-        print(f"New bounds: ({self.min_x}, {self.min_y}) to ({self.max_x}, {self.max_y})")
+        return self.apply_affine(scale_factor)
 
     def center_commands(self, width, height):
         """Center the drawing in the specified dimensions"""
         print(f"Centering drawing in {width}x{height} area")
 
-        if self.min_x == float('inf'):
+        offsets = self.center_offsets(width, height)
+        if offsets is None:
             print("No valid commands to center")
-            return
+            return True
 
-        # Calculate offsets
-        drawing_width = self.max_x - self.min_x
-        drawing_height = self.max_y - self.min_y
-
-        offset_x = int((width - drawing_width) / 2 - self.min_x)
-        offset_y = int((height - drawing_height) / 2 - self.min_y)
-
-        print(f"Applying offsets: X={offset_x}, Y={offset_y}")
-
-        # Apply offsets
-        centered_commands = []
-        for cmd in self.commands:
-            if cmd['type'] == 'PA':
-                centered_cmd = cmd.copy()
-                centered_cmd['x'] = cmd['x'] + offset_x
-                centered_cmd['y'] = cmd['y'] + offset_y
-                centered_commands.append(centered_cmd)
-            else:
-                centered_commands.append(cmd)
+        return self.apply_affine(1, *offsets)
 
-        # Update bounds
-        self.min_x += offset_x
-        self.min_y += offset_y
-        self.max_x += offset_x
-        self.max_y += offset_y
+    def center_offsets(self, width, height, scale_factor=1):
+        """Offsets that center the drawing, once scaled, in the specified
+        dimensions, or None if there is nothing to center"""
+        if self.min_x == float('inf'):
+            return None
 
-        self.commands = centered_commands
-        print(f"New bounds: ({self.min_x}, {self.min_y}) to ({self.max_x}, {self.max_y})")
+        # Bounds the drawing will have after scaling. These are the truncated
+        # coordinates apply_affine() produces, so the result can sit one unit
+        # off from centering on the unscaled float bounds, as this did before.
+        min_x, max_x = sorted((int(self.min_x * scale_factor), int(self.max_x * scale_factor)))
+        min_y, max_y = sorted((int(self.min_y * scale_factor), int(self.max_y * scale_factor)))
+
+        # Calculate offsets
+        drawing_width = max_x - min_x
+        drawing_height = max_y - min_y
+
+        offset_x = int((width - drawing_width) / 2 - min_x)
+        offset_y = int((height - drawing_height) / 2 - min_y)
+        return offset_x, offset_y
+
+    def apply_affine(self, scale_factor=1, offset_x=0, offset_y=0):
+        """Map every coordinate to int(c * scale_factor) + offset in a single
+        pass per axis. Returns False, leaving the drawing as it was, if the
+        results don't fit the coordinate arrays."""
+        if self.verbose:
+            print(f"Applying scale {scale_factor}, offsets: X={offset_x}, Y={offset_y}")
+
+        # x/y mean nothing outside PA commands, so every entry can be
+        # transformed; the maps feed the new arrays without a temporary list
+        commands = self.commands
+        try:
+            if scale_factor != 1:
+                scale = scale_factor.__mul__
+                xs = array('i', map(offset_x.__add__, map(int, map(scale, commands.xs))))
+                ys = array('i', map(offset_y.__add__, map(int, map(scale, commands.ys))))
+            elif offset_x or offset_y:
+                xs = array('i', map(offset_x.__add__, commands.xs))
+                ys = array('i', map(offset_y.__add__, commands.ys))
+            else:
+                xs, ys = commands.xs, commands.ys
+        except OverflowError:
+            print(f"Error: coordinates scaled by {scale_factor} are out of range")
+            return False
+        commands.xs, commands.ys = xs, ys
+
+        # The mapping is monotonic per axis, so the bounds follow directly
+        if self.min_x != float('inf'):
+            self.min_x, self.max_x = sorted((int(self.min_x * scale_factor) + offset_x,
+                                             int(self.max_x * scale_factor) + offset_x))
+            self.min_y, self.max_y = sorted((int(self.min_y * scale_factor) + offset_y,
+                                             int(self.max_y * scale_factor) + offset_y))
+        if self.verbose:
+            print(f"New bounds: ({self.min_x}, {self.min_y}) to ({self.max_x}, {self.max_y})")
+        return True
 
     def save_to_file(self, filename):
         """Save processed commands to an HPGL file"""
         print(f"Saving to file: {filename}")
 
         try:
+            # Format everything first and write it in one call
+            out = []
+            append = out.append
+            pen_down = False
+            commands = self.commands
+            for cmd_type, x, y, power in commands:
+                if cmd_type == CMD_HOME:
+                    append("IN;")
+                elif cmd_type == CMD_PU:
+                    append("PU;")
+                    pen_down = False
+                elif cmd_type == CMD_PD:
+                    append("PD;")
+                    pen_down = True
+                elif cmd_type == CMD_PA:
+                    append("PD%d,%d;" % (x, y) if pen_down else "PU%d,%d;" % (x, y))
+                elif cmd_type == CMD_SP:
+                    # Convert back to HPGL pen format (0-8)
+                    append("SP%d;" % PWM_TO_SP[power])
+
             with open(filename, 'w') as f:
-                pen_down = False
-                for cmd in self.commands:
-                    if cmd['type'] == 'HOME':
-                        f.write("IN;")
-                    elif cmd['type'] == 'PU':
-                        f.write("PU;")
-                        pen_down = False
-                    elif cmd['type'] == 'PD':
-                        f.write("PD;")
-                        pen_down = True
-                    elif cmd['type'] == 'PA':
-                        if pen_down:
-                            f.write(f"PD{cmd['x']},{cmd['y']};")
-                        else:
-                            f.write(f"PU{cmd['x']},{cmd['y']};")
-                    elif cmd['type'] == 'SP':
-                        # Convert back to HPGL pen format (0-8)
-                        pen = max(0, min(8, int((cmd['power'] / 255) * 8)))
-                        f.write(f"SP{pen};")
+                f.write(''.join(out))
 
             print(f"File saved successfully with {len(self.commands)} commands")
             return True
@@ -251,22 +196,27 @@ class HPGLProcessor:
         print(f"Exporting to Arduino command file: {filename}")
 
         try:
+            out = [
+                "# Arduino HPGL Commands\n",
+                "# Format: COMMAND:PARAMS\n",
+                "# Use with Serial connection\n\n",
+            ]
+            append = out.append
+            commands = self.commands
+            for cmd_type, x, y, power in commands:
+                if cmd_type == CMD_HOME:
+                    append("HOME:\n")
+                elif cmd_type == CMD_PU:
+                    append("PU:\n")
+                elif cmd_type == CMD_PD:
+                    append("PD:\n")
+                elif cmd_type == CMD_PA:
+                    append("PA:%d,%d\n" % (x, y))
+                elif cmd_type == CMD_SP:
+                    append("SP:%d\n" % power)
+
             with open(filename, 'w') as f:
-                f.write("# Arduino HPGL Commands\n")
-                f.write("# Format: COMMAND:PARAMS\n")
-                f.write("# Use with Serial connection\n\n")
-
-                for cmd in self.commands:
-                    if cmd['type'] == 'HOME':
-                        f.write("HOME:\n")
-                    elif cmd['type'] == 'PU':
-                        f.write("PU:\n")
-                    elif cmd['type'] == 'PD':
-                        f.write("PD:\n")
-                    elif cmd['type'] == 'PA':
-                        f.write(f"PA:{cmd['x']},{cmd['y']}\n")
-                    elif cmd['type'] == 'SP':
-                        f.write(f"SP:{cmd['power']}\n")
+                f.write(''.join(out))
 
             print(f"Arduino command file saved successfully")
             return True
@@ -284,21 +234,35 @@ def main():
     parser.add_argument('-c', '--center', action='store_true', help='Center drawing')
     parser.add_argument('-w', '--width', type=int, default=1800, help='Work area width')
     parser.add_argument('-t', '--height', type=int, default=1800, help='Work area height')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print bounds and offsets')
 
     args = parser.parse_args()
+    if args.scale is not None and not math.isfinite(args.scale):
+        parser.error("scale factor must be a finite number")
 
-    processor = HPGLProcessor()
+    processor = HPGLProcessor(verbose=args.verbose)
 
     # Parse input file
     if not processor.parse_file(args.input):
         sys.exit(1)
 
-    # Apply transformations
+    # Apply transformations in a single pass over the coordinates
+    scale_factor = args.scale or 1
+    offset_x = offset_y = 0
     if args.scale:
-        processor.scale_commands(args.scale)
+        print(f"Scaling by factor {scale_factor}")
 
     if args.center:
-        processor.center_commands(args.width, args.height)
+        print(f"Centering drawing in {args.width}x{args.height} area")
+        offsets = processor.center_offsets(args.width, args.height, scale_factor)
+        if offsets is None:
+            print("No valid commands to center")
+        else:
+            offset_x, offset_y = offsets
+
+    if args.scale or args.center:
+        if not processor.apply_affine(scale_factor, offset_x, offset_y):
+            sys.exit(1)
 
     # Save output
     if args.output: